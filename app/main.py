@@ -1,28 +1,52 @@
+import time
+
+_import_started = time.perf_counter()
+
+import logging
+import os
+from functools import lru_cache
 from typing import List, Optional
 from fastapi import FastAPI
 from .database import engine
-from .models import Base
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from . import models, schemas, database
-from passlib.context import CryptContext
+from .ratelimit import limiter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+# Допустимое время от импорта модуля до готовности воркера (в секундах)
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2.0"))
+
 app = FastAPI()
 
-# Для генерации документации
+# Схемой управляет alembic ('alembic upgrade head'), тут только проверяем ревизию одним запросом
 @app.on_event("startup")
 def startup():
-    Base.metadata.create_all(bind=engine)
+    database.check_schema_version(engine)
+    # Недоступная или отстающая реплика не мешает старту, чтения просто идут в основную базу
+    if database.replica_engine is not None and not database.replica_healthy(force=True):
+        logger.warning("Read replica is unavailable or behind, reads will use the primary")
+    database.start_replica_monitor()
+
+    elapsed = time.perf_counter() - _import_started
+    if elapsed > STARTUP_BUDGET_SECONDS:
+        logger.warning("Startup took %.3fs, budget is %.3fs", elapsed, STARTUP_BUDGET_SECONDS)
+    else:
+        logger.info("Startup took %.3fs", elapsed)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib и bcrypt подгружаются при первом обращении, а не при старте воркера
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Функция для хэширования пароля
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 # Создание сессии с базой данных
 def get_db():
@@ -32,6 +56,37 @@ def get_db():
     finally:
         db.close()
 
+# Время последней записи клиента: cookie от track_writes или такой же заголовок для API-клиентов
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+def get_last_write(request: Request) -> Optional[float]:
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+# Сессия только для чтения: реплика, если она настроена и клиент недавно не писал
+def get_read_db(request: Request):
+    db = database.read_session_factory(get_last_write(request))()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# После успешной записи на время READ_STICKY_SECONDS читаем данные клиента из основной базы.
+# Метка хранится у клиента, поэтому видна любому воркеру
+@app.middleware("http")
+async def track_writes(request: Request, call_next):
+    response = await call_next(request)
+    if (database.replica_engine is not None
+            and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400):
+        last_write = f"{time.time():.3f}"
+        response.set_cookie(LAST_WRITE_COOKIE, last_write, max_age=int(database.READ_STICKY_SECONDS) + 1, httponly=True)
+        response.headers[LAST_WRITE_HEADER] = last_write
+    return response
+
 @app.post("/users/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # Проверка, существует ли уже пользователь с таким номером телефона
@@ -55,15 +110,12 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return new_user
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
 
-import os
 SECRET_KEY = os.urandom(32).hex()
   # Замените на свой секретный ключ
 ALGORITHM = "HS256"
@@ -80,10 +132,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    from jose import jwt  # jose тянет за собой cryptography, поэтому импорт ленивый
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+# Извлечение номера телефона пользователя из токена
+def get_token_subject(token: str) -> str:
+    from jose import JWTError, jwt  # jose тянет за собой cryptography, поэтому импорт ленивый
+
+    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        phone_number: str = payload.get("sub")
+        if phone_number is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    return phone_number
+
+
+# Ограничение частоты отправки сообщений: на пользователя, на канал/чат и общее.
+# Ведро пользователя ключуется по User.id из проверенного токена
+def message_rate_limit(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    phone_number = get_token_subject(token)
+    user = db.query(models.User.id).filter(models.User.phone_number == phone_number).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    channel_id = request.path_params.get("channel_id")
+    if channel_id is None and "chat_id" in request.path_params:
+        channel_id = f"chat:{request.path_params['chat_id']}"
+
+    if limiter.check(user_id=user.id, channel_id=channel_id):
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": "1"})
+
+
 # Эндпоинт для аутентификации
 @app.post("/token")
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
@@ -95,7 +179,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return {"access_token": access_token, "token_type": "bearer"}
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_user(db, phone_number: str):
     return db.query(models.User).filter(models.User.phone_number == phone_number).first()
@@ -103,15 +187,7 @@ def get_user(db, phone_number: str):
 
 @app.post("/chats/", response_model=schemas.Chat)
 def create_chat(chat: schemas.ChatCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    phone_number = get_token_subject(token)
 
     # Получаем ID пользователя, который создает чат
     creator = db.query(models.User).filter(models.User.phone_number == phone_number).first()
@@ -130,18 +206,10 @@ def create_chat(chat: schemas.ChatCreate, db: Session = Depends(get_db), token:
     return new_chat
 
 
-@app.post("/chats/{chat_id}/messages/", response_model=schemas.Message)
+@app.post("/chats/{chat_id}/messages/", response_model=schemas.Message, dependencies=[Depends(message_rate_limit)])
 def send_message(chat_id: int, message: schemas.Message, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     # Извлечение пользователя из токена
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    phone_number = get_token_subject(token)
 
     # Здесь можно добавить дополнительную логику, например, проверку, что пользователь состоит в чате
     new_message = models.Message(
@@ -158,14 +226,7 @@ def send_message(chat_id: int, message: schemas.Message, db: Session = Depends(g
 @app.post("/channels/", response_model=schemas.Channel)
 def create_channel(channel: schemas.ChannelCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     # Извлечение пользователя из токена
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    phone_number = get_token_subject(token)
 
     # Создание нового канала
     new_channel = models.Channel(admin_id=int(phone_number), avatar_url=channel.avatar_url)
@@ -174,17 +235,10 @@ def create_channel(channel: schemas.ChannelCreate, db: Session = Depends(get_db)
     db.refresh(new_channel)
     return new_channel
 
-@app.post("/channels/{channel_id}/messages/", response_model=schemas.ChannelMessage)
+@app.post("/channels/{channel_id}/messages/", response_model=schemas.ChannelMessage, dependencies=[Depends(message_rate_limit)])
 def send_channel_message(channel_id: int, message: schemas.ChannelMessage, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     # Извлечение пользователя из токена
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    phone_number = get_token_subject(token)
 
     # Создание нового сообщения в канале
     new_message = models.ChannelMessage(
@@ -199,11 +253,11 @@ def send_channel_message(channel_id: int, message: schemas.ChannelMessage, db: S
     return new_message
 
 @app.get("/channels/", response_model=List[schemas.Channel])
-def get_channels(db: Session = Depends(get_db)):
+def get_channels(db: Session = Depends(get_read_db)):
     channels = db.query(models.Channel).all()
     return channels
 @app.get("/channels/{channel_id}/messages/", response_model=List[schemas.ChannelMessage])
-def get_channel_messages(channel_id: int, db: Session = Depends(get_db)):
+def get_channel_messages(channel_id: int, db: Session = Depends(get_read_db)):
     messages = db.query(models.ChannelMessage).filter(models.ChannelMessage.channel_id == channel_id).all()
     if not messages:
         raise HTTPException(status_code=404, detail="Этого канала не существует.")
@@ -231,10 +285,14 @@ def remove_member(channel_id: int, user_id: int, db: Session = Depends(get_db),
     return {"detail": "Member removed successfully"}
 
 @app.get("/channels/{channel_id}/members/", response_model=List[schemas.ChannelMember])
-def get_channel_members(channel_id: int, db: Session = Depends(get_db)):
+def get_channel_members(channel_id: int, db: Session = Depends(get_read_db)):
     members = db.query(models.ChannelMember).filter(models.ChannelMember.channel_id == channel_id).all()
     return members
 
+@app.get("/metrics/ratelimit")
+def get_rate_limit_metrics():
+    return limiter.metrics()
+
 @app.post("/notifications/", response_model=schemas.Notification)
 def create_notification(notification: schemas.NotificationCreate, db: Session = Depends(get_db)):
     new_notification = models.Notification(**notification.dict())
@@ -244,12 +302,12 @@ def create_notification(notification: schemas.NotificationCreate, db: Session =
     return new_notification
 
 @app.get("/notifications/{user_id}/", response_model=List[schemas.Notification])
-def get_notifications(user_id: int, db: Session = Depends(get_db)):
+def get_notifications(user_id: int, db: Session = Depends(get_read_db)):
     notifications = db.query(models.Notification).filter(models.Notification.user_id == user_id).all()
     return notifications
 
 @app.get("/channels/search/", response_model=List[schemas.Channel])
-def search_channels(query: str, db: Session = Depends(get_db)):
+def search_channels(query: str, db: Session = Depends(get_read_db)):
     channels = db.query(models.Channel).filter(models.Channel.name.ilike(f"%{query}%")).all()
     return channels
 
@@ -264,7 +322,7 @@ def update_member_role(channel_id: int, user_id: int, role: str, db: Session = D
     return {"detail": "Member role updated successfully"}
 
 
-@app.post("/messages/direct/", response_model=schemas.DirectMessage)
+@app.post("/messages/direct/", response_model=schemas.DirectMessage, dependencies=[Depends(message_rate_limit)])
 def send_direct_message(message: schemas.DirectMessageCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     new_message = models.DirectMessage(**message.dict())
     db.add(new_message)
@@ -274,7 +332,7 @@ def send_direct_message(message: schemas.DirectMessageCreate, db: Session = Depe
 
 
 @app.get("/messages/direct/{user_id}/", response_model=List[schemas.DirectMessage])
-def get_direct_messages(user_id: int, db: Session = Depends(get_db)):
+def get_direct_messages(user_id: int, db: Session = Depends(get_read_db)):
     messages = db.query(models.DirectMessage).filter(
         (models.DirectMessage.sender_id == user_id) | (models.DirectMessage.receiver_id == user_id)
     ).all()
@@ -286,6 +344,14 @@ from fastapi import WebSocket, WebSocketDisconnect
 # Хранение подключенных пользователей
 active_connections: dict = {}
 
+# user_id в пути WebSocket ничем не подтверждён, поэтому ведро лимита заводим на соединение,
+# а общее ведро user:{User.id} остаётся только для запросов с токеном
+def ws_rate_key(websocket: WebSocket) -> str:
+    return f"ws:{id(websocket)}"
+
+# Отдельный JSON-кадр, чтобы клиент мог отличить его от сообщений собеседников
+RATE_LIMITED_FRAME = {"error": "rate_limited"}
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     await websocket.accept()
@@ -294,6 +360,9 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
     try:
         while True:
             data = await websocket.receive_text()
+            if limiter.check(user_id=ws_rate_key(websocket)):
+                await websocket.send_json(RATE_LIMITED_FRAME)
+                continue
             # Здесь обрабатывать входящие сообщения
             await send_message_to_user(user_id, data)
     except WebSocketDisconnect:
@@ -350,6 +419,9 @@ async def chat_websocket(websocket: WebSocket, user_id: int):
     try:
         while True:
             data = await websocket.receive_text()
+            if limiter.check(user_id=ws_rate_key(websocket)):
+                await websocket.send_json(RATE_LIMITED_FRAME)
+                continue
             # Обработка личных сообщений
             await manager.send_personal_message(user_id, data)
     except WebSocketDisconnect:
@@ -361,6 +433,10 @@ async def channel_websocket(websocket: WebSocket, channel_id: int, user_id: int)
     try:
         while True:
             data = await websocket.receive_text()
+            # Лишние сообщения отбрасываем до рассылки участникам канала
+            if limiter.check(user_id=ws_rate_key(websocket), channel_id=channel_id):
+                await websocket.send_json(RATE_LIMITED_FRAME)
+                continue
             # Обработка сообщений для канала
             await manager.broadcast_channel_message(channel_id, data, user_id)
     except WebSocketDisconnect:
@@ -380,12 +456,12 @@ async def create_channel_websocket(websocket: WebSocket, admin_id: int):
 
 
 @app.get("/channels/{channel_id}/messages/", response_model=List[schemas.ChannelMessage])
-def get_channel_messages(channel_id: int, db: Session = Depends(get_db)):
+def get_channel_messages(channel_id: int, db: Session = Depends(get_read_db)):
     messages = db.query(models.ChannelMessage).filter(models.ChannelMessage.channel_id == channel_id).order_by(models.ChannelMessage.timestamp).all()
     return messages
 
 @app.get("/messages/direct/{user_id}/", response_model=List[schemas.DirectMessage])
-def get_direct_messages(user_id: int, db: Session = Depends(get_db)):
+def get_direct_messages(user_id: int, db: Session = Depends(get_read_db)):
     messages = db.query(models.DirectMessage).filter(
         (models.DirectMessage.sender_id == user_id) | (models.DirectMessage.receiver_id == user_id)
     ).order_by(models.DirectMessage.timestamp).all()
@@ -393,15 +469,7 @@ def get_direct_messages(user_id: int, db: Session = Depends(get_db)):
 
 @app.put("/chats/{chat_id}/", response_model=schemas.Chat)
 def update_chat(chat_id: int, chat: schemas.ChatUpdate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    phone_number = get_token_subject(token)
 
     # Получаем ID пользователя, который делает запрос
     user = db.query(models.User).filter(models.User.phone_number == phone_number).first()
@@ -423,15 +491,7 @@ def update_chat(chat_id: int, chat: schemas.ChatUpdate, db: Session = Depends(ge
 
 @app.post("/chats/{chat_id}/admins/")
 def add_admin(chat_id: int, user_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    phone_number = get_token_subject(token)
 
     # Получаем ID пользователя, который делает запрос
     user = db.query(models.User).filter(models.User.phone_number == phone_number).first()
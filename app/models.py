@@ -57,12 +57,16 @@ class UserChat(Base):
     user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     chat_id = Column(Integer, ForeignKey('chats.id'), primary_key=True)
 
+    user = relationship('User', back_populates='chats')
+
 class UserChannel(Base):
     __tablename__ = 'user_channels'
 
     user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     channel_id = Column(Integer, ForeignKey('channels.id'), primary_key=True)
 
+    user = relationship('User', back_populates='channels')
+
 
 
 
@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Хранилище ведёр в памяти процесса. Для нескольких воркеров можно передать в RateLimiter
+# своё хранилище (например, на Redis) с таким же методом consume
+class MemoryBucketStore:
+    def __init__(self, max_keys: int = 100_000, prune_interval: float = 60):
+        self.max_keys = max_keys
+        self.prune_interval = prune_interval
+        self._buckets: dict = {}  # key -> (токены, время последнего обновления, скорость, размер)
+        self._last_prune = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Атомарно списывает cost из всех ведер сразу. Если хоть одно пустое, ничего не списывается
+    # и возвращается индекс этого ведра, иначе None
+    def consume(self, buckets: List[Tuple[str, float, float]], cost: float = 1.0) -> Optional[int]:
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            for index, (key, rate, burst) in enumerate(buckets):
+                tokens, updated, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+                tokens = min(burst, tokens + (now - updated) * rate)
+                if tokens < cost:
+                    return index
+                refilled.append((key, tokens, rate, burst))
+
+            for key, tokens, rate, burst in refilled:
+                self._buckets[key] = (tokens - cost, now, rate, burst)
+
+            if len(self._buckets) > self.max_keys and now - self._last_prune >= self.prune_interval:
+                self._prune(now)
+        return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+    def _prune(self, now: float):
+        # Выкидываем ведра, которые за время простоя успели наполниться целиком,
+        # у каждого ведра свои скорость и размер
+        self._last_prune = now
+        for key, (tokens, updated, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+
+# Лимиты на пользователя, на канал и общий (скорость в запросах/сек и размер пачки)
+class RateLimiter:
+    def __init__(self, store=None,
+                 user_rate: float = 5, user_burst: float = 10,
+                 channel_rate: float = 20, channel_burst: float = 40,
+                 global_rate: float = 500, global_burst: float = 1000):
+        self.store = store or MemoryBucketStore()
+        self.limits = {
+            "user": (user_rate, user_burst),
+            "channel": (channel_rate, channel_burst),
+            "global": (global_rate, global_burst),
+        }
+        self.allowed = 0
+        self.throttled: Counter = Counter()  # Сколько запросов отклонено, по видам лимита
+        self._lock = threading.Lock()
+
+    # Возвращает вид лимита, который сработал, или None если запрос можно пропустить
+    def check(self, user_id=None, channel_id=None) -> Optional[str]:
+        scopes = []
+        if user_id is not None:
+            scopes.append(("user", f"user:{user_id}"))
+        if channel_id is not None:
+            scopes.append(("channel", f"channel:{channel_id}"))
+        scopes.append(("global", "global"))
+
+        buckets = [(key, *self.limits[scope]) for scope, key in scopes]
+        refused = self.store.consume(buckets)
+        if refused is not None:
+            scope, key = scopes[refused]
+            with self._lock:
+                self.throttled[scope] += 1
+            # Во время флуда это строка на каждый отброшенный запрос, сводка есть в metrics()
+            logger.debug("Rate limit hit: scope=%s key=%s", scope, key)
+            return scope
+
+        with self._lock:
+            self.allowed += 1
+        return None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"allowed": self.allowed, "throttled": dict(self.throttled)}
+
+
+limiter = RateLimiter(
+    user_rate=float(os.getenv("RATE_LIMIT_USER_RATE", "5")),
+    user_burst=float(os.getenv("RATE_LIMIT_USER_BURST", "10")),
+    channel_rate=float(os.getenv("RATE_LIMIT_CHANNEL_RATE", "20")),
+    channel_burst=float(os.getenv("RATE_LIMIT_CHANNEL_BURST", "40")),
+    global_rate=float(os.getenv("RATE_LIMIT_GLOBAL_RATE", "500")),
+    global_burst=float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "1000")),
+)
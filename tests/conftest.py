@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+import pytest
+
+# Приложение создаёт движки при импорте, поэтому базы подменяем до импорта app.*:
+# два файла SQLite вместо основной базы и реплики
+_databases_dir = tempfile.mkdtemp(prefix="alios-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_databases_dir, 'primary.db')}"
+os.environ["REPLICA_DATABASE_URL"] = f"sqlite:///{os.path.join(_databases_dir, 'replica.db')}"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("time.monotonic", clock)
+    return clock
+
+
+# Схема и alembic_version в обеих базах, как после 'alembic upgrade head'
+@pytest.fixture
+def databases():
+    from sqlalchemy import text
+
+    from app import database
+    from app.models import Base
+
+    binds = [bind for bind in (database.engine, database.replica_engine) if bind is not None]
+    for bind in binds:
+        Base.metadata.create_all(bind=bind)
+        with bind.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS alembic_version (version_num VARCHAR(32) NOT NULL PRIMARY KEY)"
+            ))
+            connection.execute(text("DELETE FROM alembic_version"))
+            connection.execute(text("INSERT INTO alembic_version VALUES (:revision)"), {"revision": database.SCHEMA_REVISION})
+    database._replica_lag.update(checked=0.0, healthy=True)
+
+    yield database
+
+    for bind in binds:
+        Base.metadata.drop_all(bind=bind)
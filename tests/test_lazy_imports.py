@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("jose", "passlib", "cryptography")
+
+
+# jose, passlib и cryptography должны подгружаться при первом запросе, а не при импорте приложения
+def test_app_import_does_not_load_heavy_modules(tmp_path):
+    code = (
+        "import sys\n"
+        "import app.main\n"
+        f"loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+        "print(','.join(loaded))\n"
+    )
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'primary.db'}")
+    env.pop("REPLICA_DATABASE_URL", None)
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
@@ -0,0 +1,81 @@
+from app.ratelimit import MemoryBucketStore, RateLimiter
+
+
+def drain(store, bucket) -> int:
+    consumed = 0
+    while store.consume([bucket]) is None:
+        consumed += 1
+    return consumed
+
+
+def test_bucket_refills_over_time(clock):
+    limiter = RateLimiter(user_rate=1, user_burst=3)
+    assert [limiter.check(user_id=1) for _ in range(4)] == [None, None, None, "user"]
+
+    clock.now += 1
+    assert limiter.check(user_id=1) is None
+    assert limiter.check(user_id=1) == "user"
+
+    clock.now += 100
+    assert [limiter.check(user_id=1) for _ in range(4)] == [None, None, None, "user"]
+
+
+def test_scopes_are_checked_user_channel_global(clock):
+    limiter = RateLimiter(user_rate=0, user_burst=1, channel_rate=0, channel_burst=2, global_rate=0, global_burst=3)
+    assert limiter.check(user_id=1, channel_id=7) is None
+    assert limiter.check(user_id=1, channel_id=7) == "user"
+    assert limiter.check(user_id=2, channel_id=7) is None
+    assert limiter.check(user_id=3, channel_id=7) == "channel"
+    assert limiter.check(user_id=4, channel_id=8) is None
+    assert limiter.check(user_id=5, channel_id=9) == "global"
+    assert limiter.metrics() == {"allowed": 3, "throttled": {"user": 1, "channel": 1, "global": 1}}
+
+
+def test_refused_request_does_not_drain_other_buckets(clock):
+    limiter = RateLimiter(user_rate=0, user_burst=2, channel_rate=0, channel_burst=1)
+    assert limiter.check(user_id=1, channel_id=7) is None
+    for _ in range(5):
+        assert limiter.check(user_id=2, channel_id=7) == "channel"
+    # Отказы по каналу не тронули ведро пользователя 2
+    assert limiter.check(user_id=2, channel_id=8) is None
+    assert limiter.check(user_id=2, channel_id=9) is None
+    assert limiter.check(user_id=2, channel_id=10) == "user"
+
+
+def test_prune_uses_each_bucket_own_limits(clock):
+    store = MemoryBucketStore(max_keys=2, prune_interval=0)
+    global_bucket = ("global", 0.0, 1000.0)
+    channel_bucket = ("channel:1", 0.0, 40.0)
+    for _ in range(900):
+        assert store.consume([global_bucket]) is None
+    for _ in range(25):
+        assert store.consume([channel_bucket]) is None
+
+    # Пользовательские ведра с маленьким размером запускают чистку
+    clock.now += 10
+    for user_id in range(3):
+        assert store.consume([(f"user:{user_id}", 5.0, 10.0)]) is None
+
+    assert drain(store, global_bucket) == 100
+    assert drain(store, channel_bucket) == 15
+
+
+def test_prune_drops_refilled_buckets(clock):
+    store = MemoryBucketStore(max_keys=2, prune_interval=0)
+    store.consume([("user:1", 1.0, 2.0)])
+    store.consume([("user:2", 1.0, 2.0)])
+    clock.now += 10
+    store.consume([("user:3", 1.0, 2.0)])
+    assert len(store) == 1
+
+
+def test_prune_runs_at_most_once_per_interval(clock):
+    store = MemoryBucketStore(max_keys=1, prune_interval=60)
+    store.consume([("user:1", 1.0, 2.0)])
+    clock.now += 10
+    store.consume([("user:2", 1.0, 2.0)])
+    assert len(store) == 2
+
+    clock.now += 60
+    store.consume([("user:3", 1.0, 2.0)])
+    assert len(store) == 1
@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("jose")
+from fastapi.testclient import TestClient
+
+from app import main, models
+from app.ratelimit import RateLimiter
+
+SEND_ROUTES = [
+    ("/chats/5/messages/", {"id": 1, "chat_id": 5, "sender_id": 1001, "content": "hi", "timestamp": "2026-01-01"}),
+    ("/channels/5/messages/", {"id": 1, "channel_id": 5, "sender_id": 1001, "content": "hi", "timestamp": "2026-01-01T00:00:00"}),
+    ("/messages/direct/", {"sender_id": 1001, "receiver_id": 1002, "content": "hi"}),
+]
+
+
+@pytest.fixture
+def client(databases, monkeypatch):
+    monkeypatch.setattr(main, "limiter", RateLimiter(user_rate=0, user_burst=1, channel_rate=0, channel_burst=1))
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def user(databases):
+    db = databases.SessionLocal()
+    try:
+        user = models.User(phone_number="1001", name="Test", password_hash="x")
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def auth_headers(phone_number: str) -> dict:
+    return {"Authorization": f"Bearer {main.create_access_token(data={'sub': phone_number})}"}
+
+
+@pytest.mark.parametrize("path, body", SEND_ROUTES)
+def test_send_routes_return_429_when_user_bucket_is_empty(client, user, path, body):
+    assert main.limiter.check(user_id=user) is None
+
+    response = client.post(path, json=body, headers=auth_headers("1001"))
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert main.limiter.metrics()["throttled"] == {"user": 1}
+
+
+def test_channel_send_returns_429_when_channel_bucket_is_empty(client, user):
+    assert main.limiter.check(channel_id=5) is None
+
+    path, body = SEND_ROUTES[1]
+    response = client.post(path, json=body, headers=auth_headers("1001"))
+
+    assert response.status_code == 429
+    assert main.limiter.metrics()["throttled"] == {"channel": 1}
+
+
+def test_websocket_drops_frames_over_limit(client, user):
+    with client.websocket_connect(f"/ws/chat/{user}") as websocket:
+        websocket.send_text("first")
+        assert websocket.receive_text() == "first"
+        websocket.send_text("second")
+        assert websocket.receive_json() == {"error": "rate_limited"}
+
+    # user_id в пути WebSocket не подтверждён, поэтому HTTP-квота пользователя не тронута
+    assert main.limiter.check(user_id=user) is None
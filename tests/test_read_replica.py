@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+from sqlalchemy import text
+
+from app import models
+
+
+@pytest.fixture
+def client(databases):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    from app import main
+    return TestClient(main.app)
+
+
+# Уведомление есть только в основной базе, так видно, куда ушло чтение
+@pytest.fixture
+def primary_only_notification(databases):
+    db = databases.SessionLocal()
+    try:
+        db.add(models.Notification(user_id=1, channel_id=1, message="primary", read=False))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_reads_use_primary_without_replica(databases, monkeypatch):
+    monkeypatch.setattr(databases, "replica_engine", None)
+    assert databases.read_session_factory() is databases.SessionLocal
+    assert databases.read_session_factory(time.time()) is databases.SessionLocal
+
+
+def test_reads_use_healthy_replica(databases, primary_only_notification):
+    factory = databases.read_session_factory()
+    assert factory is databases.ReplicaSessionLocal
+
+    db = factory()
+    try:
+        assert db.query(models.Notification).count() == 0
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("offset, expected", [
+    (-1, "SessionLocal"),
+    (-60, "ReplicaSessionLocal"),
+    (1e9, "ReplicaSessionLocal"),
+    (1, "ReplicaSessionLocal"),
+])
+def test_sticky_window_after_write(databases, offset, expected):
+    assert databases.read_session_factory(time.time() + offset) is getattr(databases, expected)
+
+
+def test_unhealthy_replica_falls_back_to_primary(databases, monkeypatch):
+    monkeypatch.setattr(databases, "replica_healthy", lambda: False)
+    assert databases.read_session_factory() is databases.SessionLocal
+
+
+def test_replica_behind_on_migrations_is_unhealthy(databases):
+    with databases.replica_engine.begin() as connection:
+        connection.execute(text("UPDATE alembic_version SET version_num = 'older'"))
+    assert databases.replica_healthy(force=True) is False
+    assert databases.read_session_factory() is databases.SessionLocal
+
+
+def test_replica_health_is_cached(databases, monkeypatch, clock):
+    probes = []
+    monkeypatch.setattr(databases, "_probe_replica", lambda: probes.append(clock.now) or True)
+
+    assert databases.replica_healthy() is True
+    assert databases.replica_healthy() is True
+    assert len(probes) == 1
+
+    clock.now += databases.REPLICA_LAG_CHECK_SECONDS
+    databases.replica_healthy()
+    assert len(probes) == 2
+
+    # С фоновым монитором запросы реплику не проверяют даже по устаревшему кэшу
+    monkeypatch.setattr(databases, "_replica_monitor", object())
+    clock.now += 100
+    databases.replica_healthy()
+    assert len(probes) == 2
+
+
+def test_track_writes_marks_successful_writes(client):
+    response = client.post("/notifications/", json={"user_id": 1, "channel_id": 1, "message": "hi"})
+
+    assert response.status_code == 200
+    last_write = float(response.headers["X-Last-Write"])
+    assert abs(time.time() - last_write) < 5
+    assert "last_write" in response.cookies
+
+
+def test_track_writes_ignores_reads_and_failed_writes(client):
+    for response in (client.get("/notifications/1/"), client.post("/users/", json={})):
+        assert "X-Last-Write" not in response.headers
+        assert "set-cookie" not in response.headers
+
+
+@pytest.mark.parametrize("offset, expected", [(0, 1), (-60, 0), (1e9, 0)])
+def test_read_routes_follow_last_write_header(client, primary_only_notification, offset, expected):
+    client.cookies.clear()
+    response = client.get("/notifications/1/", headers={"X-Last-Write": str(time.time() + offset)})
+    assert response.status_code == 200
+    assert len(response.json()) == expected
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+alembic_config = pytest.importorskip("alembic.config")
+from alembic.script import ScriptDirectory
+
+from app import database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_schema_revision_matches_alembic_head():
+    config = alembic_config.Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    head = ScriptDirectory.from_config(config).get_current_head()
+    assert database.SCHEMA_REVISION == head